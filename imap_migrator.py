@@ -1,55 +1,419 @@
 import imaplib
 import getpass
 import sys
-import email
+import email.parser
+import email.policy
 import os
 import re
+import functools
+import base64
+import collections
 import concurrent.futures
+import threading
+import time
 import io
-import gzip
+import csv
+import tempfile
 import logging
 import traceback
+import zlib
 
 # Configurar logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def get_mailbox_name(mailbox_string):
-    """Extracts the mailbox name from a mailbox string."""
+# Messages fetched and appended per batch
+BATCH_SIZE = 100
+# System flags looked at while migrating messages
+SEEN = b'\\Seen'
+RECENT = b'\\Recent'
+# Keep FETCH commands well below the request size limits enforced by servers
+MAX_SEQUENCE_SET_LENGTH = 8192
+FETCH_BODY_RE = re.compile(rb'BODY\[\] \{(\d+)\}')
+LIST_RESPONSE_RE = re.compile(rb'\((?P<flags>[^)]*)\) (?P<delimiter>"(?:[^"\\]|\\.)*"|NIL) (?P<name>.+?)\s*$', re.IGNORECASE)
+NAMESPACE_RE = re.compile(rb'\(\(("(?:[^"\\]|\\.)*")')
+QUOTED_CHAR_RE = re.compile(r'\\(.)')
+# Mailboxes with these LIST flags can't be selected and hold no messages
+UNSELECTABLE_FLAGS = {b'\\noselect', b'\\nonexistent'}
+HEADER_PARSER = email.parser.BytesHeaderParser(policy=email.policy.default)
+# Default number of mailboxes migrated in parallel, each over its own pair of connections
+DEFAULT_WORKERS = 4
+# Maximum number of account migrations run at the same time
+MAX_PARALLEL_MIGRATIONS = 8
+# Number of APPEND commands sent before waiting for their responses
+APPEND_PIPELINE_DEPTH = 8
+# Responses to APPEND that nothing reads, dropped so they don't pile up on pooled connections
+APPEND_RESPONSES = ('APPENDUID', 'EXISTS', 'RECENT')
+# Pooled connections idle for this long are sent a NOOP so servers don't drop them
+KEEPALIVE_INTERVAL = 20 * 60
+# Batches of fetched messages larger than this are spooled to disk instead of kept in memory
+SPOOL_MAX_SIZE = 16 << 20
+SPOOL_CHUNK_SIZE = 64 * 1024
+
+# Idle logged-in connections, keyed by (server, email address)
+_POOL = {}
+_POOL_LOCK = threading.Lock()
+_POOL_CLOSED = threading.Event()
+_keepalive_thread = None
+
+class MigratorIMAP4_SSL(imaplib.IMAP4_SSL):
+    """IMAP4_SSL connection that can pipeline APPEND commands, spool fetched messages and compress traffic."""
+
+    def __init__(self, *args, **kwargs):
+        self.literal_batch = None
+        self._personal_namespace = None
+        self._hierarchy_delimiter = None
+        self.selected_mailbox = None
+        self._compressor = None
+        self._decompressor = None
+        self._inflated = bytearray()
+        self._chunk_buffer = bytearray(SPOOL_CHUNK_SIZE)
+        super().__init__(*args, **kwargs)
+
+    def login(self, user, password):
+        """Logs in and refreshes the capabilities, which servers often extend once authenticated."""
+        status, data = super().login(user, password)
+        if 'CAPABILITY' in self.untagged_responses:
+            # Sent as a response code of the LOGIN reply, no need to ask again
+            capabilities = self.untagged_responses.pop('CAPABILITY')[-1]
+            self.capabilities = tuple(str(capabilities, self._encoding).upper().split())
+        else:
+            self._get_capabilities()
+        return status, data
+
+    def enable_compression(self):
+        """Turns on COMPRESS=DEFLATE (RFC 4978) if the server supports it and returns whether it did."""
+        if 'COMPRESS=DEFLATE' not in self.capabilities:
+            return False
+        status, data = self.xatom('COMPRESS', 'DEFLATE')
+        if status != 'OK':
+            return False
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        self._decompressor = zlib.decompressobj(-15)
+        return True
+
+    def _inflate(self):
+        """Decompresses the next block received from the server, returns False at EOF."""
+        data = self.file.read1(SPOOL_CHUNK_SIZE)
+        if not data:
+            return False
+        self._inflated += self._decompressor.decompress(data)
+        return True
+
+    def _read(self, size):
+        """Reads up to size bytes from the server, decompressing them if needed."""
+        if self._decompressor is None:
+            return super().read(size)
+        while len(self._inflated) < size:
+            if not self._inflate():
+                break
+        data = bytes(self._inflated[:size])
+        del self._inflated[:size]
+        return data
+
+    def readline(self):
+        """Reads a line from the server, decompressing it if needed."""
+        if self._decompressor is None:
+            return super().readline()
+        start = 0
+        while True:
+            end = self._inflated.find(b'\n', start)
+            if end != -1:
+                line = bytes(self._inflated[:end + 1])
+                del self._inflated[:end + 1]
+                return line
+            if len(self._inflated) > imaplib._MAXLINE:
+                raise self.error(f"got more than {imaplib._MAXLINE} bytes")
+            start = len(self._inflated)
+            if not self._inflate():
+                line = bytes(self._inflated)
+                self._inflated.clear()
+                return line
+
+    def send(self, data):
+        """Sends data to the server, compressing it if needed."""
+        if self._compressor is not None:
+            data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        super().send(data)
+
+    def ensure_selected(self, mailbox, readonly=False):
+        """Selects a mailbox unless it is already the selected one on this connection."""
+        if self.selected_mailbox == (mailbox, readonly):
+            return 'OK', [None]
+        # A failed SELECT leaves no mailbox selected
+        self.selected_mailbox = None
+        status, data = self.select(mailbox, readonly)
+        if status == 'OK':
+            self.selected_mailbox = (mailbox, readonly)
+        return status, data
+
+    def personal_namespace(self):
+        """Returns the personal namespace prefix from NAMESPACE (RFC 2342), or '' if there is none."""
+        if self._personal_namespace is None:
+            self._personal_namespace = ''
+            if 'NAMESPACE' in self.capabilities:
+                status, data = self.namespace()
+                match = NAMESPACE_RE.match(data[0] or b'') if status == 'OK' else None
+                if match:
+                    self._personal_namespace = unquote_mailbox(match.group(1).decode('utf-8', 'surrogateescape'))
+        return self._personal_namespace
+
+    def hierarchy_delimiter(self):
+        """Returns the server's hierarchy delimiter, or None if it has a flat namespace."""
+        if self._hierarchy_delimiter is None:
+            self._hierarchy_delimiter = ''
+            # LIST with an empty mailbox name only asks for the delimiter (RFC 3501 6.3.8)
+            status, data = self.list('""', '""')
+            if status == 'OK' and data and data[0]:
+                self._hierarchy_delimiter = parse_list_line(data[0])[1] or ''
+        return self._hierarchy_delimiter or None
+
+    def read(self, size):
+        """Reads a literal, appending it to the spool of literal_batch and returning its offset there while one is set."""
+        batch = self.literal_batch
+        if batch is None:
+            return self._read(size)
+        spool = batch.spool
+
+        spool.seek(0, io.SEEK_END)
+        offset = spool.tell()
+        if offset + size > SPOOL_MAX_SIZE:
+            # The size is known up front, so skip growing an in-memory buffer first
+            spool.rollover()
+            batch.rolled_over = True
+        # Copy through the connection's reusable buffer instead of allocating bytes for every chunk
+        buffer = memoryview(self._chunk_buffer)
+        remaining = size
+        while remaining:
+            if self._decompressor is None:
+                chunk = buffer[:self.file.readinto(buffer[:min(remaining, len(buffer))])]
+            else:
+                chunk = self._read(min(remaining, len(buffer)))
+            if not chunk:
+                raise self.abort('socket error: EOF')
+            spool.write(chunk)
+            remaining -= len(chunk)
+        return offset
+
+    def uid_fetch_spooled(self, uid_set, message_parts, batch):
+        """UID FETCH that appends message literals to the spool of a MessageBatch and returns their offsets instead of bytes."""
+        self.literal_batch = batch
+        try:
+            return self.uid('FETCH', uid_set, message_parts)
+        finally:
+            self.literal_batch = None
+
+    def send_literal(self, spool, offset, size):
+        """Sends size bytes of a spool file, starting at offset, to the server in chunks."""
+        spool.seek(offset)
+        remaining = size
+        while remaining:
+            chunk = spool.read(min(remaining, SPOOL_CHUNK_SIZE))
+            if not chunk:
+                raise self.abort('spooled message is truncated')
+            self.send(chunk)
+            remaining -= len(chunk)
+
+    def send_append(self, mailbox, flags_str, spool, offset, size, literal_plus):
+        """Sends an APPEND command followed by the spooled message as its literal and returns its tag.
+
+        The command prefix and the message are written separately, so the message is never
+        copied into a larger command buffer like imaplib's append() does.
+        """
+        tag = self._new_tag()
+        command = b'%s APPEND %s (%s) {%d%s}' % (tag, mailbox.encode(self._encoding), flags_str.encode(self._encoding), size, b'+' if literal_plus else b'')
+        if __debug__ and self.debug >= 4:
+            self._mesg(f'> {command!r}')
+        try:
+            self.send(command + imaplib.CRLF)
+            if not literal_plus:
+                # Wait for the server to ask for the literal
+                while self._get_response():
+                    if self.tagged_commands[tag]:
+                        return tag
+            self.send_literal(spool, offset, size)
+            self.send(imaplib.CRLF)
+        except OSError as e:
+            raise self.abort(f'socket error: {e}')
+        return tag
+
+    def append_pipelined(self, mailbox, messages, depth=APPEND_PIPELINE_DEPTH):
+        """Appends the messages of a MessageBatch to a mailbox and returns one (typ, data) result per message.
+
+        With LITERAL+ (RFC 2088) the literals don't need a continuation response, so
+        up to `depth` APPEND commands are sent before reading their tagged responses.
+        Without it every message is appended sequentially. If the connection is aborted
+        midway, responses to the APPENDs already sent are never read, so the connection
+        must be discarded.
+        """
+        literal_plus = 'LITERAL+' in self.capabilities
+        if not literal_plus:
+            depth = 1
+
+        results = []
+        for i in range(0, len(messages), depth):
+            tags = [self.send_append(mailbox, messages.flags[j], messages.spool, messages.offsets[j], messages.sizes[j], literal_plus)
+                    for j in range(i, min(i + depth, len(messages)))]
+            for tag in tags:
+                try:
+                    results.append(self._command_complete('APPEND', tag))
+                except self.abort:
+                    raise
+                except self.error as e:
+                    results.append(('BAD', [str(e).encode()]))
+            for response in APPEND_RESPONSES:
+                self.untagged_responses.pop(response, None)
+        return results
+
+class MessageBatch:
+    """Fetched messages stored back to back in one spool file, with their offsets, sizes and flags in parallel lists."""
+
+    def __init__(self):
+        self.spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        # Set by MigratorIMAP4_SSL.read() when a literal moves the spool to disk
+        self.rolled_over = False
+        self.offsets = []
+        self.sizes = []
+        self.flags = []
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def add(self, offset, size, flags_str):
+        """Records a message already written to the spool."""
+        self.offsets.append(offset)
+        self.sizes.append(size)
+        self.flags.append(flags_str)
+
+    def clear(self):
+        """Empties the batch so the next one can reuse its spool file."""
+        if self.rolled_over:
+            # Start the next batch in memory again, even if the literals on disk were never recorded
+            self.spool.close()
+            self.spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            self.rolled_over = False
+        else:
+            self.spool.seek(0)
+            self.spool.truncate()
+        self.offsets.clear()
+        self.sizes.clear()
+        self.flags.clear()
+
+    def close(self):
+        """Releases the spool file."""
+        self.spool.close()
+
+
+def quote_mailbox(name):
+    """Quotes a mailbox name for use in an IMAP command."""
+    return '"' + name.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def unquote_mailbox(name):
+    """Removes the IMAP quoting from a mailbox name, if it has any."""
+    if len(name) >= 2 and name[0] == name[-1] == '"':
+        return QUOTED_CHAR_RE.sub(r'\1', name[1:-1])
+    return name
+
+def map_hierarchy(mailbox_name, src_delimiter, dst_delimiter):
+    """Rewrites a quoted mailbox name from the source hierarchy delimiter to the destination one."""
+    if not src_delimiter or not dst_delimiter or src_delimiter == dst_delimiter:
+        return mailbox_name
+    return quote_mailbox(unquote_mailbox(mailbox_name).replace(src_delimiter, dst_delimiter))
+
+def imap_utf7_encode(name):
+    """Encodes a mailbox name in the modified UTF-7 of RFC 3501."""
+    encoded = []
+    pending = []
+
+    def flush():
+        if pending:
+            utf16 = ''.join(pending).encode('utf-16-be', 'surrogatepass')
+            encoded.append('&' + base64.b64encode(utf16).rstrip(b'=').replace(b'/', b',').decode('ascii') + '-')
+            pending.clear()
+
+    for char in name:
+        if ' ' <= char <= '~':
+            flush()
+            encoded.append('&-' if char == '&' else char)
+        else:
+            pending.append(char)
+    flush()
+    return ''.join(encoded)
+
+@functools.lru_cache(maxsize=1024)
+def parse_list_line(mailbox_string):
+    """Parses a raw LIST response line into (flags, delimiter, name).
+
+    The name is returned in wire form, modified UTF-7 encoded and quoted, so it can be used in commands as is.
+    """
     logging.debug(f"Analyzing mailbox string: {mailbox_string}")
-    match = re.search(r'"([^"]+)"$', mailbox_string)
+    literal = None
+    if isinstance(mailbox_string, tuple):
+        # The name was sent as a literal after the rest of the line
+        mailbox_string, literal = mailbox_string
+        mailbox_string = mailbox_string[:mailbox_string.rfind(b'{')] + b'""'
+
+    match = LIST_RESPONSE_RE.match(mailbox_string)
     if match:
-        return match.group(1)
+        flags = tuple(match.group('flags').split())
+        delimiter = match.group('delimiter').decode('utf-8', 'surrogateescape')
+        delimiter = None if delimiter.upper() == 'NIL' else unquote_mailbox(delimiter)
+        name = unquote_mailbox(match.group('name').decode('utf-8', 'surrogateescape'))
     else:
-        return mailbox_string.split()[-1]
+        flags, delimiter = (), None
+        name = unquote_mailbox(mailbox_string.split()[-1].decode('utf-8', 'surrogateescape'))
+    if literal is not None:
+        name = literal.decode('utf-8', 'surrogateescape')
+
+    # ASCII names are already in modified UTF-7, only raw 8-bit names need encoding
+    if not name.isascii():
+        name = imap_utf7_encode(name)
+    return flags, delimiter, quote_mailbox(name)
 
 def read_config_file():
     """Reads the configuration data from the 'emails.txt' file."""
     debug_mode = False
+    workers = DEFAULT_WORKERS
     migrations = []
 
     try:
-        with open('emails.txt', 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith('debug='):
-                    debug_mode = line.split('=')[1].lower() == 'true'
-                else:
-                    source, destination = line.split(';')
-                    source_data = source.split(',')
-                    destination_data = destination.split(',')
+        with open('emails.txt', 'rb') as f:
+            text = f.read().decode()
 
-                    # Validate that each section has 3 elements
-                    if len(source_data) != 3 or len(destination_data) != 3:
-                        raise ValueError("Invalid format")
+        rows = []
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            key, separator, value = line.partition('=')
+            if separator and key == 'debug':
+                debug_mode = value.lower() == 'true'
+            elif separator and key == 'workers':
+                workers = int(value)
+                if workers < 1:
+                    raise ValueError("workers must be at least 1")
+            else:
+                rows.append(line)
+
+        for row in csv.reader(rows, delimiter=';'):
+            if len(row) != 2:
+                raise ValueError("Invalid format")
+            # Split at most twice so that passwords may contain commas
+            source_data = row[0].split(',', 2)
+            destination_data = row[1].split(',', 2)
 
-                    migrations.append((source_data, destination_data))
+            # Validate that each section has 3 elements
+            if len(source_data) != 3 or len(destination_data) != 3:
+                raise ValueError("Invalid format")
 
-        return debug_mode, migrations
+            migrations.append((source_data, destination_data))
 
-    except (FileNotFoundError, ValueError) as e:
+        return debug_mode, workers, migrations
+
+    except (FileNotFoundError, ValueError, csv.Error) as e:
         logging.error(f"Error reading config file: {str(e)}")
         print("Invalid 'emails.txt' file format. The file should have the following format:")
         print("debug=true/false")
+        print("workers=number of mailboxes migrated in parallel (optional, default 4)")
         print("source1_server,source1_email,source1_password;destination1_server,destination1_email,destination1_password")
         print("source2_server,source2_email,source2_password;destination2_server,destination2_email,destination2_password")
         print("...")
@@ -61,128 +425,355 @@ def create_mailbox(imap, mailbox_name):
         imap.create(mailbox_name)
         imap.subscribe(mailbox_name)
         logging.info(f"Mailbox created and subscribed: {mailbox_name}")
+    except imaplib.IMAP4.abort:
+        raise
     except imaplib.IMAP4.error as e:
         logging.error(f"Could not create or subscribe to mailbox {mailbox_name}: {e}")
 
-def migrate_emails(src_server, src_email, src_password, dst_server, dst_email, dst_password, debug_mode):
+def connect(server, email_address, password, debug_mode):
+    """Opens a connection to an IMAP server and logs in."""
+    imap = MigratorIMAP4_SSL(server)
+    try:
+        imap.login(email_address, password)
+        if debug_mode:
+            imap.debug = 4
+        if imap.enable_compression():
+            logging.debug(f"COMPRESS=DEFLATE enabled on {server}")
+    except:
+        # Don't leak the socket, workers retry the connection for every mailbox
+        imap.shutdown()
+        raise
+    imap.pool_key = (server, email_address)
+    return imap
+
+def checkout(server, email_address, password, debug_mode):
+    """Takes an idle connection for (server, email_address) from the pool, or logs in a new one."""
+    global _keepalive_thread
+    with _POOL_LOCK:
+        if _keepalive_thread is None:
+            _keepalive_thread = threading.Thread(target=keepalive, name='imap-keepalive', daemon=True)
+            _keepalive_thread.start()
+    while True:
+        with _POOL_LOCK:
+            idle = _POOL.get((server, email_address))
+            imap = idle.pop() if idle else None
+        if imap is None:
+            break
+        # The server may have dropped the connection while it was idle, check it before handing it out
+        try:
+            imap.noop()
+        except (imaplib.IMAP4.error, OSError) as e:
+            logging.debug(f"Dropping idle connection to {server}: {e}")
+            invalidate(imap)
+            continue
+        logging.debug(f"Reusing connection to {server} as {email_address}")
+        return imap
+
+    logging.info(f"Connecting to {server} as {email_address}")
+    imap = connect(server, email_address, password, debug_mode)
+    logging.info(f"Successful connection to {server}.")
+    return imap
+
+def checkin(imap):
+    """Returns a connection to the pool so it can be reused, or logs it out if the pool is closed."""
+    with _POOL_LOCK:
+        if not _POOL_CLOSED.is_set():
+            imap.idle_since = time.monotonic()
+            _POOL.setdefault(imap.pool_key, []).append(imap)
+            return
+    try:
+        imap.logout()
+    except:
+        pass
+
+def invalidate(imap):
+    """Closes a broken connection instead of returning it to the pool."""
+    # Don't LOGOUT, the stream may be out of sync and the reply would never come
+    try:
+        imap.shutdown()
+    except:
+        pass
+
+def keepalive():
+    """Sends NOOP to pooled connections idle for KEEPALIVE_INTERVAL so servers don't drop them."""
+    while True:
+        # Take out only one stale connection at a time, the rest stay available to checkout()
+        imap = None
+        wait = KEEPALIVE_INTERVAL
+        with _POOL_LOCK:
+            now = time.monotonic()
+            for connections in _POOL.values():
+                # checkout() pops from the end, so the first connection has been idle the longest
+                if not connections:
+                    continue
+                idle = now - connections[0].idle_since
+                if idle >= KEEPALIVE_INTERVAL:
+                    imap = connections.pop(0)
+                    break
+                wait = min(wait, KEEPALIVE_INTERVAL - idle)
+        if imap is None:
+            if _POOL_CLOSED.wait(wait):
+                return
+            continue
+        try:
+            imap.noop()
+        except (imaplib.IMAP4.error, OSError) as e:
+            logging.debug(f"Dropping idle connection to {imap.pool_key[0]}: {e}")
+            invalidate(imap)
+        else:
+            checkin(imap)
+
+def close_pool():
+    """Logs out every idle pooled connection, and any checked in later."""
+    with _POOL_LOCK:
+        _POOL_CLOSED.set()
+        idle = [imap for connections in _POOL.values() for imap in connections]
+        _POOL.clear()
+    for imap in idle:
+        try:
+            imap.logout()
+        except:
+            pass
+
+def migrate_emails(src_server, src_email, src_password, dst_server, dst_email, dst_password, debug_mode, workers=DEFAULT_WORKERS):
     """Migrates emails from the source server to the destination server."""
     logging.info("Starting migration process...")
 
-    try:
-        # Connect to the source server
-        logging.info(f"Connecting to source server: {src_server}")
-        src_imap = imaplib.IMAP4_SSL(src_server)
-        src_imap.login(src_email, src_password)
-        if debug_mode:
-            src_imap.debug = 4
-        logging.info("Successful connection to source server.")
+    # Each worker thread checks out a connection pair once and reuses it for every mailbox it processes
+    local = threading.local()
+    pairs = []
+    pairs_lock = threading.Lock()
 
-        # Connect to the destination server
-        logging.info(f"Connecting to destination server: {dst_server}")
-        dst_imap = imaplib.IMAP4_SSL(dst_server)
-        dst_imap.login(dst_email, dst_password)
-        if debug_mode:
-            dst_imap.debug = 4
-        logging.info("Successful connection to destination server.")
+    def connect_pair():
+        """Returns the (src_imap, dst_imap) pair owned by the current thread."""
+        if not hasattr(local, 'pair'):
+            src_imap = checkout(src_server, src_email, src_password, debug_mode)
+            try:
+                dst_imap = checkout(dst_server, dst_email, dst_password, debug_mode)
+            except:
+                checkin(src_imap)
+                raise
+            local.pair = (src_imap, dst_imap)
+            with pairs_lock:
+                pairs.append(local.pair)
+        return local.pair
+
+    def release_pair(broken=False):
+        """Returns the current thread's connection pair to the pool, or closes it if it is broken."""
+        pair = getattr(local, 'pair', None)
+        if pair is None:
+            return
+        del local.pair
+        with pairs_lock:
+            pairs.remove(pair)
+        for imap in pair:
+            if broken:
+                invalidate(imap)
+            else:
+                checkin(imap)
+
+    def worker(mailbox_name, delimiter):
+        """Migrates a single mailbox using the current thread's connections."""
+        try:
+            src_imap, dst_imap = connect_pair()
+            process_mailbox(src_imap, dst_imap, mailbox_name, delimiter, debug_mode)
+        except Exception as e:
+            logging.error(f"Error processing mailbox {mailbox_name}: {str(e)}")
+            logging.debug(traceback.format_exc())
+            if isinstance(e, (imaplib.IMAP4.abort, OSError)):
+                # The connection is unusable, the next mailbox will get a new one
+                release_pair(broken=True)
+
+    def drain(pending):
+        """Migrates mailboxes from the pending queue until it is empty or no connection can be opened."""
+        while pending:
+            # Connect before taking a mailbox, so a failed login leaves it to the threads that are connected
+            try:
+                connect_pair()
+            except (imaplib.IMAP4.error, OSError) as e:
+                logging.warning(f"Could not open another pair of connections, continuing with fewer workers: {e}")
+                return
+            try:
+                mailbox_name, delimiter = pending.popleft()
+            except IndexError:
+                return
+            worker(mailbox_name, delimiter)
+
+    try:
+        src_imap, dst_imap = connect_pair()
 
         # Get the list of mailboxes from the source server
         status, mailboxes = src_imap.list()
         if status != 'OK':
             logging.error("Error getting the list of mailboxes from the source server.")
             return
-
-        # Process mailboxes sequentially for better error handling
+        pending = collections.deque()
         for mailbox in mailboxes:
-            mailbox_name = get_mailbox_name(mailbox.decode())
-            try:
-                process_mailbox(src_imap, dst_imap, mailbox_name, debug_mode)
-            except Exception as e:
-                logging.error(f"Error processing mailbox {mailbox_name}: {str(e)}")
-                logging.debug(traceback.format_exc())
+            if not mailbox:
+                continue
+            flags, delimiter, mailbox_name = parse_list_line(mailbox)
+            if UNSELECTABLE_FLAGS.intersection(flag.lower() for flag in flags):
+                logging.debug(f"Skipping mailbox that can't be selected: {mailbox_name}")
+                continue
+            pending.append((mailbox_name, delimiter))
+
+        # Hand the connections used for LIST to the first worker
+        release_pair()
+
+        # Process mailboxes in parallel, each worker thread with its own connections
+        threads = max(1, min(workers, len(pending)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(drain, [pending] * threads))
 
+        if pending:
+            logging.error(f"Migration incomplete, no connection could be opened for {len(pending)} mailboxes: "
+                          f"{', '.join(mailbox_name for mailbox_name, delimiter in pending)}")
+            return
         logging.info("Migration process finished.")
 
+    except (imaplib.IMAP4.abort, OSError) as e:
+        logging.error(f"IMAP connection lost: {e}")
+        release_pair(broken=True)
     except imaplib.IMAP4.error as e:
         logging.error(f"IMAP error: {e}")
     except Exception as e:
         logging.error(f"Unexpected error: {e}")
         logging.debug(traceback.format_exc())
     finally:
-        # Close connections
-        try:
-            src_imap.logout()
-            dst_imap.logout()
-        except:
-            pass
+        # Return the connections to the pool for the next migration of the same accounts
+        for pair in pairs:
+            for imap in pair:
+                checkin(imap)
 
-def process_mailbox(src_imap, dst_imap, mailbox_name, debug_mode):
+def process_mailbox(src_imap, dst_imap, mailbox_name, delimiter, debug_mode):
     """Process a single mailbox."""
     logging.info(f"Processing mailbox: {mailbox_name}")
 
-    # Select the source mailbox
-    for name_format in [mailbox_name, f'"{mailbox_name}"', f'INBOX.{mailbox_name}', f'"INBOX.{mailbox_name}"']:
-        try:
-            status, messages = src_imap.select(name_format, readonly=True)
-            if status == 'OK':
-                logging.info(f"Mailbox successfully selected: {name_format}")
-                break
-        except Exception as e:
-            logging.error(f"Error selecting {name_format}: {e}")
-    else:
+    # Select the source mailbox using the name exactly as the server listed it
+    selected_name = mailbox_name
+    try:
+        status, messages = src_imap.ensure_selected(selected_name, readonly=True)
+        if status != 'OK':
+            # Only retry with the personal namespace prefix when the server has one
+            prefix = src_imap.personal_namespace()
+            name = unquote_mailbox(mailbox_name)
+            if prefix and not name.startswith(prefix):
+                selected_name = quote_mailbox(prefix + name)
+                status, messages = src_imap.ensure_selected(selected_name, readonly=True)
+    except imaplib.IMAP4.abort:
+        # Let the worker drop the broken connection instead of skipping mailboxes with it
+        raise
+    except imaplib.IMAP4.error as e:
+        logging.error(f"Error selecting {mailbox_name}: {e}")
+        status = 'NO'
+    if status != 'OK':
         logging.warning(f"Could not select mailbox {mailbox_name}. Skipping...")
         return
+    logging.info(f"Mailbox successfully selected: {selected_name}")
 
-    # Create the mailbox on the destination server
-    create_mailbox(dst_imap, mailbox_name)
+    # Create the mailbox on the destination server, keeping its place in the hierarchy
+    dst_mailbox_name = map_hierarchy(mailbox_name, delimiter, dst_imap.hierarchy_delimiter())
+    create_mailbox(dst_imap, dst_mailbox_name)
 
-    # Search for all messages
-    status, messages = src_imap.search(None, 'ALL')
+    # Search for all messages by UID, which stays valid even if messages are expunged meanwhile
+    status, messages = src_imap.uid('SEARCH', None, 'ALL')
     if status != 'OK':
         logging.error(f"Error searching for messages in {mailbox_name}")
         return
 
-    # Process messages in batches
-    batch_size = 100
-    message_nums = messages[0].split()
-    for i in range(0, len(message_nums), batch_size):
-        batch = message_nums[i:i+batch_size]
-        process_message_batch(src_imap, dst_imap, mailbox_name, batch, debug_mode)
+    # Process messages in batches, reusing one spool file for all of them
+    message_uids = messages[0].split()
+    messages_data = MessageBatch()
+    try:
+        for i in range(0, len(message_uids), BATCH_SIZE):
+            batch = message_uids[i:i+BATCH_SIZE]
+            process_message_batch(src_imap, dst_imap, mailbox_name, dst_mailbox_name, batch, messages_data, debug_mode)
+    finally:
+        messages_data.close()
 
-def process_message_batch(src_imap, dst_imap, mailbox_name, batch, debug_mode):
+def split_sequence_set(batch, max_length=MAX_SEQUENCE_SET_LENGTH):
+    """Splits a list of message UIDs into comma-joined sets no longer than max_length."""
+    sequence_sets = []
+    current = []
+    length = 0
+    for uid in batch:
+        if current and length + len(uid) + 1 > max_length:
+            sequence_sets.append(b",".join(current))
+            current = []
+            length = 0
+        current.append(uid)
+        length += len(uid) + 1
+    if current:
+        sequence_sets.append(b",".join(current))
+    return sequence_sets
+
+def parse_fetch_response(data):
+    """Extracts (flags, offset, size) tuples from a multi-message FETCH response read with uid_fetch_spooled()."""
+    messages = []
+    for item in data:
+        if isinstance(item, tuple):
+            header, offset = item
+            match = FETCH_BODY_RE.search(header)
+            if match:
+                messages.append([header, offset, int(match.group(1))])
+        elif messages and b'FLAGS' in item and b'FLAGS' not in messages[-1][0]:
+            # Some servers send FLAGS after the message literal
+            messages[-1][0] += item
+    return [(imaplib.ParseFlags(header), offset, size) for header, offset, size in messages]
+
+def process_message_batch(src_imap, dst_imap, mailbox_name, dst_mailbox_name, batch, messages_data, debug_mode):
     """Process a batch of messages."""
-    messages_data = []
-    for num in batch:
-        try:
-            # Get the message flags
-            status, data = src_imap.fetch(num, '(FLAGS)')
-            if status != 'OK':
-                logging.error(f"Error getting the flags of message {num} in {mailbox_name}")
-                continue
-            flags = imaplib.ParseFlags(data[0])
-            flags_str = ' '.join([str(f).replace("b'\\", "").replace("'", "") for f in flags])
+    try:
+        fetch_message_batch(src_imap, mailbox_name, batch, messages_data, debug_mode)
+        append_message_batch(dst_imap, dst_mailbox_name, messages_data, debug_mode)
+    finally:
+        messages_data.clear()
 
-            # Get the full message
-            status, msg_data = src_imap.fetch(num, '(RFC822)')
+def get_subject(spool, offset, size):
+    """Returns the decoded Subject of a spooled message, parsing only its header block."""
+    spool.seek(offset)
+    headers = spool.read(min(size, SPOOL_CHUNK_SIZE))
+    header_end = headers.find(b'\r\n\r\n')
+    if header_end != -1:
+        headers = headers[:header_end + 2]
+    return str(HEADER_PARSER.parsebytes(headers)['Subject'] or '')
+
+def fetch_message_batch(src_imap, mailbox_name, batch, messages_data, debug_mode):
+    """Fetches a batch of messages into the spool of messages_data."""
+    for uid_set in split_sequence_set(batch):
+        try:
+            # Get the flags and full messages in a single round-trip; BODY.PEEK[] doesn't set \Seen on the source
+            status, data = src_imap.uid_fetch_spooled(uid_set, '(UID FLAGS BODY.PEEK[])', messages_data)
             if status != 'OK':
-                logging.error(f"Error getting message {num} from mailbox {mailbox_name}")
+                logging.error(f"Error getting messages {uid_set.decode()} from mailbox {mailbox_name}")
                 continue
 
-            # Compress the message data
-            compressed_data = gzip.compress(msg_data[0][1])
-            messages_data.append((compressed_data, flags_str))
+            for flags, offset, size in parse_fetch_response(data):
+                # \Recent is set by the server and can't be given in APPEND
+                flags_str = b' '.join(f for f in flags if f != RECENT).decode('ascii')
+                messages_data.add(offset, size, flags_str)
+                if debug_mode:
+                    read_status = 'Read' if SEEN in flags else 'Unread'
+                    logging.debug(f"Fetched {read_status} message from {mailbox_name}: {get_subject(messages_data.spool, offset, size)}")
+        except (imaplib.IMAP4.abort, OSError):
+            raise
         except Exception as e:
-            logging.error(f"Error processing message {num} in {mailbox_name}: {str(e)}")
+            logging.error(f"Error processing messages {uid_set.decode()} in {mailbox_name}: {str(e)}")
             if debug_mode:
                 logging.debug(traceback.format_exc())
 
-    # Use APPEND to add messages
+def append_message_batch(dst_imap, mailbox_name, messages_data, debug_mode):
+    """Saves a batch of fetched messages to the destination mailbox."""
+    # Use APPEND to add messages, which doesn't need the mailbox to be selected
     try:
-        dst_imap.select(mailbox_name)
-        for compressed_data, flags_str in messages_data:
-            # Decompress the data before appending
-            decompressed_data = gzip.decompress(compressed_data)
-            dst_imap.append(mailbox_name, f"({flags_str})", None, decompressed_data)
-        logging.info(f"Batch of {len(messages_data)} messages migrated to mailbox {mailbox_name}")
+        results = dst_imap.append_pipelined(mailbox_name, messages_data)
+        failed = sum(1 for status, data in results if status != 'OK')
+        if failed:
+            logging.error(f"Could not save {failed} messages to mailbox {mailbox_name}")
+        logging.info(f"Batch of {len(messages_data) - failed} messages migrated to mailbox {mailbox_name}")
+    except (imaplib.IMAP4.abort, OSError):
+        # APPENDs may be left half sent, the connection can't be used for another batch
+        raise
     except Exception as e:
         logging.error(f"Error saving batch to mailbox {mailbox_name}: {str(e)}")
         if debug_mode:
@@ -190,16 +781,32 @@ def process_message_batch(src_imap, dst_imap, mailbox_name, batch, debug_mode):
 
 def main():
     """Main function of the script."""
-    print("Email migration program")
+    logging.info("Email migration program")
+
+    debug_mode, workers, migrations = read_config_file()
 
-    debug_mode, migrations = read_config_file()
+    # --serial runs one migration and one mailbox at a time, which keeps the log readable when debugging
+    serial = '--serial' in sys.argv[1:]
+    if serial:
+        workers = 1
 
-    for source_data, destination_data in migrations:
+    def run_migration(migration):
+        source_data, destination_data = migration
         src_server, src_email, src_password = source_data
         dst_server, dst_email, dst_password = destination_data
 
         # Start migration
-        migrate_emails(src_server, src_email, src_password, dst_server, dst_email, dst_password, debug_mode)
+        migrate_emails(src_server, src_email, src_password, dst_server, dst_email, dst_password, debug_mode, workers)
+
+    try:
+        if serial or len(migrations) <= 1:
+            for migration in migrations:
+                run_migration(migration)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(migrations), MAX_PARALLEL_MIGRATIONS)) as executor:
+                list(executor.map(run_migration, migrations))
+    finally:
+        close_pool()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file